@@ -1,178 +1,490 @@
-import os, sys, json, time, hashlib, argparse
+import io, os, sys, json, time, uuid, queue, hashlib, logging, argparse
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass, fields, is_dataclass
 from pathlib import Path
-from typing import Any, Dict, List
-import boto3, yaml
+from typing import Any, Dict, List, Set, Tuple, Union
+import boto3, orjson, yaml
+from boto3.dynamodb.conditions import Attr, Key
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
+try:
+    from yaml import CSafeLoader as _YamlLoader  # libyaml bindings
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
 
 SEP = "#"  # separator used in FQIDs written to DynamoDB keys
+MB = 1024 * 1024
+# manifests above the threshold upload as parallel 8 MB parts instead of one stream
+MULTIPART = TransferConfig(multipart_threshold=8 * MB, multipart_chunksize=8 * MB, max_concurrency=8)
+TRANSACT_MAX = 100  # TransactWriteItems item limit
+BATCH_GET_MAX = 100  # BatchGetItem key limit
+UNPROCESSED_BACKOFF_SECS = 0.05  # first wait before resending UnprocessedKeys, doubled per resend up to 5s
+MANIFEST_ARGS = {"ContentType": "application/json", "CacheControl": "max-age=0,no-cache,no-store"}
+SESSION_PK = "PUBLISH_SESSION"  # one row per in-flight run, SK = session id; deleted when the run ends
+STALE_SESSION_SECS = 24 * 3600  # sessions older than this are crashed runs, not concurrent ones
+log = logging.getLogger("publish")
+
+# Slotted records built per unit/episode/activity; field names are the DynamoDB attribute / JSON keys.
+@dataclass(slots=True, kw_only=True)
+class UnitLive:
+    PK: str
+    SK: str = "LIVE"
+    entityType: str = "UNIT_LIVE"
+    title: str
+    content: str
+    episodeIds: List[str]       # local ids under this unit
+    episodeFqIds: List[str]     # helpful globally
+    updatedAt: int
+
+@dataclass(slots=True, kw_only=True)
+class EpisodeLive:
+    PK: str                     # hierarchical: EPISODE#<unit>#<episode>
+    SK: str = "LIVE"
+    entityType: str = "EPISODE_LIVE"
+    unitId: str
+    episodeId: str
+    title: str
+    activityIds: List[str]
+    activityFqIds: List[str]
+    updatedAt: int
+
+@dataclass(slots=True, kw_only=True)
+class ActivityLive:
+    PK: str                     # hierarchical: ACTIVITY#<unit>#<episode>#<activity>
+    SK: str = "LIVE"
+    entityType: str = "ACTIVITY_LIVE"
+    unitId: str
+    episodeId: str
+    activityId: str             # local
+    activityFqid: str
+    title: str
+    locale: str
+    manifestS3Key: str
+    totalQuestions: int
+    version: int
+    updatedAt: int
+
+@dataclass(slots=True, kw_only=True)
+class Manifest:
+    unitId: str
+    episodeId: str
+    activityId: str             # local id
+    activityFqId: str           # for easy client logging
+    title: str
+    version: int
+    locale: str
+    total: int
+    questions: List[Any]
+
+LiveItem = Union[UnitLive, EpisodeLive, ActivityLive]
+StoredLive = Dict[Tuple[str, str], Dict[str, Any]]  # (PK, SK) -> stored version/contentHash
+
+def _as_dict(record: Any) -> Dict[str, Any]:
+    # shallow, unlike dataclasses.asdict, which deep-copies every nested question
+    return {f.name: getattr(record, f.name) for f in fields(record)}
+
+def _start_logging() -> QueueListener:
+    # worker threads only enqueue records; the listener thread does every stderr write
+    records = queue.SimpleQueue()
+    sys.stderr.reconfigure(line_buffering=True)
+    listener = QueueListener(records, logging.StreamHandler(sys.stderr))
+    log.addHandler(QueueHandler(records))
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    listener.start()
+    return listener
 
 def _die(msg: str):
-    print(f"[ERROR] {msg}", file=sys.stderr); sys.exit(1)
+    log.error(f"[ERROR] {msg}"); sys.exit(1)
+
+def _json_bytes(obj: Any, sort_keys: bool = False) -> bytes:
+    # compact UTF-8 JSON; with sort_keys this is the canonical form hashed by _hash_short
+    if sort_keys and is_dataclass(obj):
+        obj = _as_dict(obj)  # orjson keeps dataclass field order even with OPT_SORT_KEYS
+    # orjson emits UTF-8 bytes directly (no str -> bytes copy) and serializes YAML dates and dataclasses
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0))
 
-def _sha256_short(obj: Any) -> str:
-    b = json.dumps(obj, ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode("utf-8")
-    return hashlib.sha256(b).hexdigest()[:16]
+def _hash_short(obj: Any) -> str:
+    # content fingerprint, not a security boundary: 8-byte BLAKE2b gives the 16 hex chars directly
+    return hashlib.blake2b(_json_bytes(obj, sort_keys=True), digest_size=8).hexdigest()
 
 def _load_yaml(path: Path) -> Dict[str, Any]:
     with path.open("r", encoding="utf-8") as f:
-        return yaml.safe_load(f) or {}
+        return yaml.load(f.read(), Loader=_YamlLoader) or {}
+
+def _load_yaml_many(readers: ThreadPoolExecutor, paths: List[Path]) -> List[Dict[str, Any]]:
+    # reads release the GIL, so slow/cold file I/O overlaps across files; results keep input order
+    return list(readers.map(_load_yaml, paths))
 
-def _s3_put_json(s3, bucket: str, key: str, obj: Any, dry: bool):
-    body = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+def _s3_list_keys(s3, bucket: str, prefix: str) -> Set[str]:
+    # up to 1000 keys per ListObjectsV2 call, instead of a HeadObject per key
+    keys: Set[str] = set()
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        keys.update(o["Key"] for o in page.get("Contents", []))
+    return keys
+
+def _s3_put_json(s3, bucket: str, key: str, obj: Any, dry: bool) -> str:
+    body = _json_bytes(obj)
     if dry:
-        print(f"[DRY] S3 PUT s3://{bucket}/{key} ({len(body)} bytes)"); return
-    s3.put_object(Bucket=bucket, Key=key, Body=body, ContentType="application/json",
-                  CacheControl="max-age=0,no-cache,no-store")
-    print(f"[OK ] S3 PUT s3://{bucket}/{key}")
+        log.info(f"[DRY] S3 PUT s3://{bucket}/{key} ({len(body)} bytes)"); return key
+    if len(body) >= MULTIPART.multipart_threshold:
+        s3.upload_fileobj(io.BytesIO(body), bucket, key, Config=MULTIPART, ExtraArgs=dict(MANIFEST_ARGS))
+        log.info(f"[OK ] S3 PUT s3://{bucket}/{key} (multipart)")
+    else:
+        s3.put_object(Bucket=bucket, Key=key, Body=body, **MANIFEST_ARGS)
+        log.info(f"[OK ] S3 PUT s3://{bucket}/{key}")
+    return key
 
-def _ddb_put_live(table, item: Dict[str, Any], guard_version: bool, dry: bool):
+def _s3_promote(s3, bucket: str, staged_key: str, key: str, dry: bool):
+    # server-side copy, the body never leaves S3; metadata is copied from the staged object
     if dry:
-        print(f"[DRY] DDB PUT {item['PK']} {item['SK']} -> {json.dumps(item, ensure_ascii=False)}"); return
-    kwargs = {"Item": item}
-    if guard_version and "version" in item:
-        kwargs.update({
-            "ConditionExpression": "attribute_not_exists(#v) OR #v <= :newv",
-            "ExpressionAttributeNames": {"#v": "version"},
-            "ExpressionAttributeValues": {":newv": item["version"]}
-        })
+        log.info(f"[DRY] S3 COPY s3://{bucket}/{staged_key} -> {key}"); return
     try:
-        table.put_item(**kwargs)
-        print(f"[OK ] DDB PUT {item['PK']} {item['SK']}")
+        s3.copy_object(Bucket=bucket, Key=key, CopySource={"Bucket": bucket, "Key": staged_key}, IfNoneMatch="*")
+        log.info(f"[OK ] S3 COPY s3://{bucket}/{key}")
     except ClientError as e:
-        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
-            print(f"[SKIP] Newer/equal version exists for {item['PK']} {item['SK']}")
-        else:
+        if e.response["Error"]["Code"] not in ("PreconditionFailed", "ConditionalRequestConflict"):
             raise
+        log.info(f"[SKIP] Exists s3://{bucket}/{key}")
+
+def _s3_delete_prefix(s3, bucket: str, prefix: str):
+    # list pages and DeleteObjects both cap at 1000 keys
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=prefix):
+        objects = [{"Key": o["Key"]} for o in page.get("Contents", [])]
+        if objects:
+            s3.delete_objects(Bucket=bucket, Delete={"Objects": objects, "Quiet": True})
+
+def _session_open(table, session_id: str, staging: str, now: int):
+    table.put_item(Item={"PK": SESSION_PK, "SK": session_id, "entityType": "PUBLISH_SESSION",
+                         "stagingPrefix": staging, "startedAt": now})
+
+def _session_close(table, session_id: str):
+    # committed and aborted runs leave no row, so the partition only ever holds open sessions
+    table.delete_item(Key={"PK": SESSION_PK, "SK": session_id})
+
+def _sessions_cleanup(table, s3, bucket: str, now: int):
+    # staged objects of earlier runs that died before committing or aborting
+    kwargs = {"KeyConditionExpression": Key("PK").eq(SESSION_PK),
+              "FilterExpression": Attr("startedAt").lt(now - STALE_SESSION_SECS)}
+    while True:
+        resp = table.query(**kwargs)
+        for stale in resp.get("Items", []):
+            _s3_delete_prefix(s3, bucket, stale["stagingPrefix"])
+            _session_close(table, stale["SK"])
+            log.info(f"[OK ] Cleaned up stale session {stale['SK']}")
+        if "LastEvaluatedKey" not in resp:
+            break
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+def _live_item(live: LiveItem) -> Dict[str, Any]:
+    item = _as_dict(live)
+    # rows whose content (everything but updatedAt) matches the stored contentHash are not rewritten
+    item["contentHash"] = _hash_short({k: v for k, v in item.items() if k != "updatedAt"})
+    return item
+
+def _version_guard(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "ConditionExpression": "(attribute_not_exists(#v) OR #v <= :newv) AND "
+                               "(attribute_not_exists(#h) OR #h <> :h)",
+        "ExpressionAttributeNames": {"#v": "version", "#h": "contentHash"},
+        "ExpressionAttributeValues": {":newv": item["version"], ":h": item["contentHash"]}
+    }
+
+def _ddb_get_live(table, keys: List[Tuple[str, str]]) -> StoredLive:
+    # stored version/contentHash of the rows about to be written, BATCH_GET_MAX keys per call
+    keys = list(dict.fromkeys(keys))  # BatchGetItem rejects duplicate keys
+    found: StoredLive = {}
+    for i in range(0, len(keys), BATCH_GET_MAX):
+        request = {table.name: {"Keys": [{"PK": pk, "SK": sk} for pk, sk in keys[i:i + BATCH_GET_MAX]],
+                                "ProjectionExpression": "PK, SK, #v, contentHash",
+                                "ExpressionAttributeNames": {"#v": "version"}}}
+        delay = UNPROCESSED_BACKOFF_SECS
+        while True:
+            resp = table.meta.client.batch_get_item(RequestItems=request)
+            for row in resp["Responses"].get(table.name, []):
+                found[(row["PK"], row["SK"])] = row
+            request = resp.get("UnprocessedKeys")
+            if not request:
+                break
+            # partial results aren't retried by botocore; back off so a throttled table can recover
+            time.sleep(delay)
+            delay = min(delay * 2, 5.0)
+    return found
+
+def _live_is_current(item: Dict[str, Any], stored: StoredLive) -> bool:
+    # same test as _version_guard, so writes it would reject are never sent
+    row = stored.get((item["PK"], item["SK"]))
+    if row is None:
+        return False
+    if row.get("contentHash") == item["contentHash"]:
+        return True
+    return "version" in item and "version" in row and row["version"] > item["version"]
+
+def _ddb_put_live(batch, live: LiveItem, dry: bool, stored: StoredLive):
+    # unguarded rows into a _ddb_batch writer; the put is only buffered here and sent on flush
+    item = _live_item(live)
+    if dry:
+        log.info(f"[DRY] DDB PUT {item['PK']} {item['SK']} -> {json.dumps(item, ensure_ascii=False)}"); return
+    if _live_is_current(item, stored):
+        log.info(f"[SKIP] Unchanged {item['PK']} {item['SK']}"); return
+    batch.put_item(Item=item)
+    log.info(f"[OK ] DDB PUT queued {item['PK']} {item['SK']}")
+
+def _ddb_transact_live(table, lives: List[LiveItem], dry: bool, stored: StoredLive):
+    # version-guarded rows, TRANSACT_MAX puts per TransactWriteItems call. One failed guard cancels
+    # the whole call, so rows that failed theirs (unchanged or older) are dropped and the rest resent.
+    # TransactWriteItems rejects two operations on one item, and activity ids come from the YAML, so
+    # two files can share a PK. Keep the highest version (the later file on ties), which is the row
+    # the version guard would have left behind.
+    latest: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for item in map(_live_item, lives):
+        key = (item["PK"], item["SK"])
+        if key in latest:
+            log.warning(f"[WARN] Duplicate {item['PK']} {item['SK']}; keeping the highest version")
+            if item["version"] < latest[key]["version"]:
+                continue
+        latest[key] = item
+    items = list(latest.values())
+    if dry:
+        for item in items:
+            log.info(f"[DRY] DDB PUT {item['PK']} {item['SK']} -> {json.dumps(item, ensure_ascii=False)}")
+        return
+    for item in items:
+        if _live_is_current(item, stored):
+            log.info(f"[SKIP] Unchanged, or newer version exists for {item['PK']} {item['SK']}")
+    items = [item for item in items if not _live_is_current(item, stored)]
+    for i in range(0, len(items), TRANSACT_MAX):
+        chunk = items[i:i + TRANSACT_MAX]
+        while chunk:
+            try:
+                table.meta.client.transact_write_items(TransactItems=[
+                    {"Put": {"TableName": table.name, "Item": item, **_version_guard(item)}} for item in chunk
+                ])
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "TransactionCanceledException":
+                    raise
+                reasons = e.response.get("CancellationReasons", [])
+                failed = {n for n, reason in enumerate(reasons) if reason.get("Code") == "ConditionalCheckFailed"}
+                if not failed:
+                    raise
+                for n in sorted(failed):
+                    log.info(f"[SKIP] Unchanged, or newer version exists for {chunk[n]['PK']} {chunk[n]['SK']}")
+                chunk = [item for n, item in enumerate(chunk) if n not in failed]
+                continue
+            for item in chunk:
+                log.info(f"[OK ] DDB PUT {item['PK']} {item['SK']}")
+            break
+
+def _ddb_batch(table):
+    # BatchWriteItem has no ConditionExpression, so only unguarded LIVE rows go through here;
+    # boto3 flushes in chunks of 25 and resends unprocessed items
+    return table.batch_writer(overwrite_by_pkeys=["PK", "SK"])
+
+_dir_children: Dict[str, Set[str]] = {}  # dir -> entry names, so existence checks reuse one readdir
+
+def _children(parent: Path) -> Set[str]:
+    key = str(parent)
+    if key not in _dir_children:
+        try:
+            with os.scandir(parent) as it:
+                _dir_children[key] = {e.name for e in it}
+        except (FileNotFoundError, NotADirectoryError):
+            _dir_children[key] = set()
+    return _dir_children[key]
+
+def _scan(parent: Path, prefix: str, suffix: str = "", dirs: bool = True) -> List[Path]:
+    # DirEntry.is_dir()/is_file() answer from the readdir d_type, so no extra stat per entry
+    with os.scandir(parent) as it:
+        entries = list(it)
+    _dir_children[str(parent)] = {e.name for e in entries}
+    names = sorted(e.name for e in entries if e.name.startswith(prefix) and e.name.endswith(suffix)
+                   and (e.is_dir() if dirs else e.is_file()))
+    return [parent / n for n in names]
 
 def _discover_unit_yaml(unit_dir: Path) -> Path:
-    in_dir = unit_dir / f"{unit_dir.name}.yaml"
-    sibling = unit_dir.parent / f"{unit_dir.name}.yaml"
-    if in_dir.exists(): return in_dir
-    if sibling.exists(): return sibling
+    name = f"{unit_dir.name}.yaml"
+    if name in _children(unit_dir): return unit_dir / name
+    if name in _children(unit_dir.parent): return unit_dir.parent / name
     _die(f"Unit YAML not found for {unit_dir.name}")
 
 def _discover_episode_yaml(ep_dir: Path) -> Path:
     p = ep_dir / f"{ep_dir.name}.yaml"
-    if p.exists(): return p
+    if p.name in _children(ep_dir): return p
     _die(f"Episode YAML not found: {p}")
 
 def _list_activity_yaml(ep_dir: Path) -> List[Path]:
     act_dir = ep_dir / "activities"
-    if not act_dir.exists(): return []
-    return sorted(p for p in act_dir.glob("a_*.yaml") if p.is_file())
-
-def _build_manifest(unit_id: str, episode_id: str, a_yaml: Dict[str, Any]) -> Dict[str, Any]:
-    aid = a_yaml.get("id")
-    title = a_yaml.get("title", aid)
-    version = int(a_yaml.get("version", 1))
-    locale = a_yaml.get("locale", "en-US")
-    questions = a_yaml.get("questions", [])
-    return {
-        "unitId": unit_id,
-        "episodeId": episode_id,
-        "activityId": aid,                         # local id
-        "activityFqId": f"{unit_id}/{episode_id}/{aid}",  # for easy client logging
-        "title": title,
-        "version": version,
-        "locale": locale,
-        "total": len(questions),
-        "questions": questions
-    }
+    if act_dir.name not in _children(ep_dir): return []
+    return _scan(act_dir, "a_", ".yaml", dirs=False)
+
+def _build_manifest(unit_id: str, episode_id: str, a_yaml: Dict[str, Any]) -> Manifest:
+    get = a_yaml.get  # bound once; every schema key is optional, so each read keeps its default
+    aid = get("id")
+    questions = get("questions", [])
+    return Manifest(
+        unitId=unit_id,
+        episodeId=episode_id,
+        activityId=aid,
+        activityFqId=f"{unit_id}/{episode_id}/{aid}",
+        title=get("title", aid),
+        version=int(get("version", 1)),
+        locale=get("locale", "en-US"),
+        total=len(questions),
+        questions=questions
+    )
 
 def _publish(root: Path, bucket: str, table_name: str, s3_prefix: str, region: str, dry: bool, profile: str):
     session = boto3.Session(profile_name=profile)
-    s3 = session.client("s3", region_name=region)
-    ddb = session.resource("dynamodb", region_name=region)
+    # one client per service shared by all threads; pool sized above max_workers, keep-alive
+    # connections so TLS isn't renegotiated, adaptive retries back off on S3/DDB throttling
+    config = Config(max_pool_connections=64, retries={"mode": "adaptive", "max_attempts": 10}, tcp_keepalive=True)
+    s3 = session.client("s3", region_name=region, config=config)
+    ddb = session.resource("dynamodb", region_name=region, config=config)
     table = ddb.Table(table_name)
 
     if not root.exists(): _die(f"Root not found: {root}")
+    now = int(time.time())  # one timestamp for every item written by this run
+    s3_url_prefix = f"s3://{bucket}/"
+
+    # Two-phase publish per unit: manifests are staged under this run's session prefix, promoted to
+    # their canonical keys once every upload of the unit succeeded, and only then are LIVE rows written.
+    # An aborted run deletes its staged objects; a crashed one is cleaned up by a later run.
+    session_id = uuid.uuid4().hex
+    staging = f"{s3_prefix}/_sessions/{session_id}/"
+    if not dry:
+        _sessions_cleanup(table, s3, bucket, now)
+        _session_open(table, session_id, staging, now)
+
+    try:
+        with ThreadPoolExecutor(max_workers=32) as pool, ThreadPoolExecutor(max_workers=8) as readers, \
+                _ddb_batch(table) as batch:
+            for unit_dir in _scan(root, "u_"):
+                unit_yaml = _load_yaml(_discover_unit_yaml(unit_dir))
+                unit_id = unit_yaml.get("id") or unit_dir.name
+                unit_title = unit_yaml.get("title", unit_id)
+                unit_content = unit_yaml.get("content", "")
+                # keys embed the manifest hash, so a manifest already at its canonical key is the right content
+                existing_keys = set() if dry else _s3_list_keys(s3, bucket, f"{s3_prefix}/{unit_id}/")
+
+                episodes_root = unit_dir / "episodes"
+                has_episodes = episodes_root.name in _children(unit_dir)
+                ep_dirs = _scan(episodes_root, "e_") if has_episodes else []
+                local_ep_ids = [d.name for d in ep_dirs]
+                fq_ep_ids = [f"{unit_id}{SEP}{d.name}" for d in ep_dirs]
+
+                # UNIT LIVE
+                unit_item = UnitLive(
+                    PK=f"UNIT#{unit_id}",
+                    title=unit_title,
+                    content=unit_content,
+                    episodeIds=local_ep_ids,
+                    episodeFqIds=fq_ep_ids,
+                    updatedAt=now
+                )
 
-    for unit_dir in sorted(p for p in root.iterdir() if p.is_dir() and p.name.startswith("u_")):
-        unit_yaml = _load_yaml(_discover_unit_yaml(unit_dir))
-        unit_id = unit_yaml.get("id") or unit_dir.name
-        unit_title = unit_yaml.get("title", unit_id)
-        unit_content = unit_yaml.get("content", "")
-
-        episodes_root = unit_dir / "episodes"
-        local_ep_ids: List[str] = []
-        fq_ep_ids: List[str] = []
-
-        if episodes_root.exists():
-            for ep_dir in sorted(p for p in episodes_root.iterdir() if p.is_dir() and p.name.startswith("e_")):
-                local_ep_ids.append(ep_dir.name)
-                fq_ep_ids.append(f"{unit_id}{SEP}{ep_dir.name}")
-
-        # UNIT LIVE
-        unit_item = {
-            "PK": f"UNIT#{unit_id}",
-            "SK": "LIVE",
-            "entityType": "UNIT_LIVE",
-            "title": unit_title,
-            "content": unit_content,
-            "episodeIds": local_ep_ids,         # local ids under this unit
-            "episodeFqIds": fq_ep_ids,          # helpful globally
-            "updatedAt": int(time.time())
-        }
-        _ddb_put_live(table, unit_item, guard_version=False, dry=dry)
-
-        if not episodes_root.exists():
-            print(f"[WARN] No episodes folder for unit {unit_id}")
-            continue
-
-        for ep_dir in sorted(p for p in episodes_root.iterdir() if p.is_dir() and p.name.startswith("e_")):
-            ep_yaml = _load_yaml(_discover_episode_yaml(ep_dir))
-            episode_id = ep_yaml.get("id") or ep_dir.name
-            episode_title = ep_yaml.get("title", episode_id)
-
-            acts = _list_activity_yaml(ep_dir)
-            local_act_ids = [p.stem for p in acts]  # e.g., a_1
-            fq_act_ids = [f"{unit_id}{SEP}{episode_id}{SEP}{p.stem}" for p in acts]
-
-            # EPISODE LIVE (hierarchical PK)
-            episode_item = {
-                "PK": f"EPISODE#{unit_id}{SEP}{episode_id}",
-                "SK": "LIVE",
-                "entityType": "EPISODE_LIVE",
-                "unitId": unit_id,
-                "episodeId": episode_id,
-                "title": episode_title,
-                "activityIds": local_act_ids,
-                "activityFqIds": fq_act_ids,
-                "updatedAt": int(time.time())
-            }
-            _ddb_put_live(table, episode_item, guard_version=False, dry=dry)
-
-            # Activities
-            for a_path in acts:
-                a_yaml = _load_yaml(a_path)
-                activity_id = a_yaml.get("id") or a_path.stem
-                activity_title = a_yaml.get("title", activity_id)
-                version = int(a_yaml.get("version", 1))
-
-                manifest = _build_manifest(unit_id, episode_id, a_yaml)
-                mhash = _sha256_short(manifest)
-                s3_key = f"{s3_prefix}/{unit_id}/{episode_id}/{activity_id}/v{manifest['version']}/manifest-{mhash}.json"
-                _s3_put_json(s3, bucket, s3_key, manifest, dry)
-
-                # ACTIVITY LIVE (hierarchical PK)
-                activity_item = {
-                    "PK": f"ACTIVITY#{unit_id}{SEP}{episode_id}{SEP}{activity_id}",
-                    "SK": "LIVE",
-                    "entityType": "ACTIVITY_LIVE",
-                    "unitId": unit_id,
-                    "episodeId": episode_id,
-                    "activityId": activity_id,              # local
-                    "activityFqid": f"{unit_id}{SEP}{episode_id}{SEP}{activity_id}",
-                    "title": activity_title,
-                    "locale": manifest.get("locale", "en-US"),
-                    "manifestS3Key": f"s3://{bucket}/{s3_key}",
-                    "totalQuestions": manifest["total"],
-                    "version": version,
-                    "updatedAt": int(time.time())
-                }
-                _ddb_put_live(table, activity_item, guard_version=True, dry=dry)
-
-    print("[DONE] publish complete.")
+                if not has_episodes:
+                    log.warning(f"[WARN] No episodes folder for unit {unit_id}")
+
+                episodes = []  # (episode_item, [(stage future or None, staged key, canonical key, activity_item)])
+                for ep_dir in ep_dirs:
+                    ep_yaml = _load_yaml(_discover_episode_yaml(ep_dir))
+                    episode_id = ep_yaml.get("id") or ep_dir.name
+                    episode_title = ep_yaml.get("title", episode_id)
+
+                    # built once per episode rather than per activity
+                    ep_fq = f"{unit_id}{SEP}{episode_id}"
+                    act_fq_prefix = f"{ep_fq}{SEP}"
+                    act_pk_prefix = f"ACTIVITY#{act_fq_prefix}"
+                    s3_ep_prefix = f"{s3_prefix}/{unit_id}/{episode_id}/"
+                    staged_ep_prefix = f"{staging}{unit_id}/{episode_id}/"
+
+                    acts = _list_activity_yaml(ep_dir)
+                    local_act_ids = [p.stem for p in acts]  # e.g., a_1
+                    fq_act_ids = [act_fq_prefix + p.stem for p in acts]
+
+                    # EPISODE LIVE (hierarchical PK)
+                    episode_item = EpisodeLive(
+                        PK=f"EPISODE#{ep_fq}",
+                        unitId=unit_id,
+                        episodeId=episode_id,
+                        title=episode_title,
+                        activityIds=local_act_ids,
+                        activityFqIds=fq_act_ids,
+                        updatedAt=now
+                    )
+
+                    # Activities: manifests are staged concurrently
+                    staged = []
+                    for a_path, a_yaml in zip(acts, _load_yaml_many(readers, acts)):
+                        activity_id = a_yaml.get("id") or a_path.stem
+                        activity_title = a_yaml.get("title", activity_id)
+                        version = int(a_yaml.get("version", 1))
+
+                        manifest = _build_manifest(unit_id, episode_id, a_yaml)
+                        mhash = _hash_short(manifest)
+                        key_tail = f"{activity_id}/v{manifest.version}/manifest-{mhash}.json"
+                        s3_key, staged_key = s3_ep_prefix + key_tail, staged_ep_prefix + key_tail
+                        if s3_key in existing_keys:
+                            log.info(f"[SKIP] Exists s3://{bucket}/{s3_key}")
+                            upload = None
+                        else:
+                            upload = pool.submit(_s3_put_json, s3, bucket, staged_key, manifest, dry)
+
+                        # ACTIVITY LIVE (hierarchical PK)
+                        activity_item = ActivityLive(
+                            PK=act_pk_prefix + activity_id,
+                            unitId=unit_id,
+                            episodeId=episode_id,
+                            activityId=activity_id,
+                            activityFqid=act_fq_prefix + activity_id,
+                            title=activity_title,
+                            locale=manifest.locale,
+                            manifestS3Key=s3_url_prefix + s3_key,
+                            totalQuestions=manifest.total,
+                            version=version,
+                            updatedAt=now
+                        )
+                        staged.append((upload, staged_key, s3_key, activity_item))
+                    episodes.append((episode_item, staged))
+
+                # stored versions/hashes of every LIVE row of the unit, fetched while uploads run;
+                # rows that are unchanged or older are then skipped without a write request
+                lives: List[LiveItem] = [unit_item]
+                for episode_item, staged in episodes:
+                    lives += [episode_item] + [activity_item for *_, activity_item in staged]
+                stored = {} if dry else _ddb_get_live(table, [(live.PK, live.SK) for live in lives])
+
+                # phase 1: every new manifest of the unit staged; result() re-raises a failed upload
+                # before anything is promoted
+                to_promote = [(staged_key, s3_key) for _, staged in episodes
+                              for upload, staged_key, s3_key, _ in staged if upload and upload.result()]
+                # phase 2: promoted to canonical keys, then the unit's LIVE rows are committed
+                promotions = [pool.submit(_s3_promote, s3, bucket, staged_key, s3_key, dry)
+                              for staged_key, s3_key in to_promote]
+                wait(promotions)
+                for promotion in promotions:
+                    promotion.result()
+                _ddb_put_live(batch, unit_item, dry=dry, stored=stored)
+                for episode_item, staged in episodes:
+                    _ddb_put_live(batch, episode_item, dry=dry, stored=stored)
+                    _ddb_transact_live(table, [activity_item for *_, activity_item in staged], dry=dry, stored=stored)
+                if not dry:
+                    _s3_delete_prefix(s3, bucket, f"{staging}{unit_id}/")
+    except BaseException:
+        if not dry:
+            try:
+                _s3_delete_prefix(s3, bucket, staging)
+                _session_close(table, session_id)
+            except Exception as cleanup_error:
+                # usually the same outage; leave the session for a later run and surface the original error
+                log.error(f"[ERROR] Cleanup of session {session_id} failed: {cleanup_error}")
+        raise
+    if not dry:
+        _session_close(table, session_id)
+
+    log.info("[DONE] publish complete.")
 
 def main():
     ap = argparse.ArgumentParser(description="Publish canonical Liwanag content (units, episodes, activities, questions) to DynamoDB & S3.")
@@ -182,16 +494,20 @@ def main():
     ap.add_argument("--profile", default="default", help="AWS CLI profile name (default: default)")
     args = ap.parse_args()
 
-    region = os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION") or "us-west-1"
-    table = os.environ.get("CONTENT_TABLE", "ContentTable")
-    bucket = os.environ.get("CONTENT_BUCKET", "liwanag-content-bucket")
+    listener = _start_logging()
+    try:
+        region = os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION") or "us-west-1"
+        table = os.environ.get("CONTENT_TABLE", "ContentTable")
+        bucket = os.environ.get("CONTENT_BUCKET", "liwanag-content-bucket")
 
-    if not region: _die("Set AWS_REGION")
-    if not table:  _die("Set CONTENT_TABLE")
-    if not bucket: _die("Set CONTENT_BUCKET")
+        if not region: _die("Set AWS_REGION")
+        if not table:  _die("Set CONTENT_TABLE")
+        if not bucket: _die("Set CONTENT_BUCKET")
 
-    _publish(root=Path(args.root), bucket=bucket, table_name=table,
-            s3_prefix=args.prefix.strip("/"), region=region, dry=args.dry_run, profile=args.profile)
+        _publish(root=Path(args.root), bucket=bucket, table_name=table,
+                s3_prefix=args.prefix.strip("/"), region=region, dry=args.dry_run, profile=args.profile)
+    finally:
+        listener.stop()  # drain queued records before exit
 
 if __name__ == "__main__":
     main()